@@ -1,10 +1,19 @@
 # gmail_ingest.py
 from __future__ import annotations
 import base64
+import html as htmllib
+import functools
+import hashlib
+import itertools
+import os
 import pathlib
+import queue
 import re
-import time
-from typing import Any, Dict, List, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 import html2text
 import yaml
@@ -12,15 +21,40 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+try:  # optional: C (lexbor) HTML parser, ~10x cheaper than html2text
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
 ROOT = pathlib.Path(__file__).parent
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+BATCH_SIZE = 100  # Gmail caps a batch request at 100 calls
+FETCH_WORKERS = 10  # Thread pool size when batching falls back to single gets
+MAX_TEXT = 3000  # Most newsletter text any consumer uses (weekly_agent deep analysis)
+METADATA_HEADERS = ["Subject", "From", "Message-Id", "Date"]
+# Partial-response masks: Gmail drops everything else server-side
+_LIST_FIELDS = "messages/id,nextPageToken"
+_METADATA_FIELDS = "id,internalDate,payload/headers"
+_BODY_FIELDS = "snippet,payload(mimeType,body,parts)"
+_GET_FIELDS = "internalDate,snippet,payload(headers,mimeType,body,parts)"
+_URL_RE = re.compile(r"https?://[^\s\)\]]{12,}")
+_HTML_URL_RE = re.compile(r"""(?:href|src)\s*=\s*["']?(https?://[^"'\s>]{12,})""", re.I)
+_BODY_RE = re.compile(r"<body[\s>]", re.I)
+_BLOCK_TAGS = "p,div,li,tr,table,ul,ol,blockquote,h1,h2,h3,h4,h5,h6"
+_BREAK = "\ue000"  # private-use marker for block boundaries, survives whitespace collapsing
+_WS_RE = re.compile(r"\s+")
+_BREAK_RE = re.compile(r" ?(?:\ue000 ?)+")
+_EPOCH = datetime(1970, 1, 1)
+_MD_CACHE_SIZE = 1024
+_MD_CACHE: "OrderedDict[bytes, str]" = OrderedDict()  # blake2b(html) -> markdown, FIFO-evicted
 
 # ---------- Config ----------
 def _load_config() -> dict:
     return yaml.safe_load((ROOT / "config.yaml").read_text())
 
 # ---------- Gmail client ----------
-def _gmail_service():
+@functools.lru_cache(maxsize=1)
+def _gmail_credentials() -> Credentials:
     from google.auth.transport.requests import Request
     cred_path = ROOT / "credentials.json"
     if not cred_path.exists():
@@ -60,44 +94,187 @@ def _gmail_service():
 
         token_path.write_text(creds.to_json())
 
-    return build("gmail", "v1", credentials=creds)
+    return creds
+
+@functools.lru_cache(maxsize=1)
+def _gmail_service():
+    # Static discovery doc ships with googleapiclient, so no discovery HTTP call.
+    # Call _gmail_credentials.cache_clear() / _gmail_service.cache_clear() to force re-auth.
+    return build("gmail", "v1", credentials=_gmail_credentials(), static_discovery=True)
+
+_THREAD_LOCAL = threading.local()
+
+def _thread_service():
+    # httplib2 connections aren't thread-safe, so each worker gets its own service
+    svc = getattr(_THREAD_LOCAL, "svc", None)
+    if svc is None:
+        svc = _THREAD_LOCAL.svc = build("gmail", "v1", credentials=_gmail_credentials(), static_discovery=True)
+    return svc
+
+# ---------- Batched fetch ----------
+def _iter_id_pages(q: str) -> Iterator[List[str]]:
+    """
+    Yield pages of message IDs for query q. A producer thread keeps paginating
+    messages.list while the caller works on the pages already yielded.
+    """
+    pages: "queue.Queue[Any]" = queue.Queue()
+
+    def _produce():
+        try:
+            svc = _thread_service()
+            token = None
+            while True:
+                resp = svc.users().messages().list(
+                    userId="me", q=q, pageToken=token, maxResults=BATCH_SIZE, fields=_LIST_FIELDS
+                ).execute()
+                pages.put([m["id"] for m in resp.get("messages", [])])
+                token = resp.get("nextPageToken")
+                if not token:
+                    break
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(None)
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    while (page := pages.get()) is not None:
+        if isinstance(page, Exception):
+            raise page
+        if page:
+            yield page
+    producer.join()
+
+def _chunks(ids: Iterable[str], size: int) -> Iterator[List[str]]:
+    it = iter(ids)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+
+def _fetch_messages(svc, ids: List[str], **params) -> Dict[str, Dict[str, Any]]:
+    """
+    Get many messages in BATCH_SIZE-sized batch requests (one HTTP round-trip
+    per batch instead of one per message). Returns {message_id: message}.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    failed: set = set()
+
+    def _on_msg(request_id, response, exception):
+        if exception is not None:
+            failed.add(request_id)
+            return
+        results[request_id] = response
+
+    for chunk in _chunks(ids, BATCH_SIZE):
+        try:
+            batch = svc.new_batch_http_request(callback=_on_msg)
+            for mid in chunk:
+                batch.add(svc.users().messages().get(userId="me", id=mid, **params), request_id=mid)
+            batch.execute()
+        except Exception as e:
+            print(f"⚠️  Batch request failed ({e}), retrying {len(chunk)} messages individually")
+            failed.update(mid for mid in chunk if mid not in results)
+
+    if failed:
+        results.update(_fetch_messages_threaded(sorted(failed), **params))
+    return results
+
+def _fetch_messages_threaded(ids: List[str], **params) -> Dict[str, Dict[str, Any]]:
+    """Fallback for _fetch_messages: plain gets fanned out over a thread pool."""
+    def _get(mid):
+        return _thread_service().users().messages().get(userId="me", id=mid, **params).execute()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as ex:
+        futures = {ex.submit(_get, mid): mid for mid in ids}
+        for fut in as_completed(futures):
+            mid = futures[fut]
+            try:
+                results[mid] = fut.result()
+            except Exception as e:
+                print(f"⚠️  Failed to fetch message {mid}: {e}")
+    return results
 
 # ---------- Helpers ----------
-def _get_header(headers: List[Dict[str, str]], name: str) -> Optional[str]:
+def _header_map(headers: List[Dict[str, str]]) -> Dict[str, Optional[str]]:
+    # Lower-cased name -> value; first occurrence wins, like a linear scan would
+    hdr: Dict[str, Optional[str]] = {}
     for h in headers:
-        if h.get("name", "").lower() == name.lower():
-            return h.get("value")
-    return None
+        hdr.setdefault(h.get("name", "").lower(), h.get("value"))
+    return hdr
 
 def _html_to_md(html: str) -> str:
-    h = html2text.HTML2Text()
-    h.ignore_images = False
-    h.ignore_links = False
-    h.body_width = 0
-    return h.handle(html)
+    key = hashlib.blake2b(html.encode("utf-8", "ignore"), digest_size=8).digest()
+    md = _MD_CACHE.get(key)
+    if md is not None:
+        return md
+
+    if os.getenv("HTML_TO_MD") == "selectolax" and LexborHTMLParser is not None:
+        md = _html_to_text_fast(html)
+    else:
+        # Fresh instance per call on purpose: HTML2Text keeps parser state (list/quote
+        # nesting, open <pre>) across handle() calls, and construction is only ~µs.
+        h = html2text.HTML2Text()
+        h.ignore_images = False
+        h.ignore_links = False
+        h.body_width = 0
+        md = h.handle(html)
+
+    _MD_CACHE[key] = md
+    if len(_MD_CACHE) > _MD_CACHE_SIZE:
+        _MD_CACHE.popitem(last=False)
+    return md
+
+def _html_to_text_fast(html: str) -> str:
+    """Plain text + [label](href) links via lexbor. No other markdown."""
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(["script", "style", "head"])
+    root = tree.body or tree.root
+    if root is None:
+        return ""
+    for a in root.css("a[href]"):
+        label = a.text(strip=True)
+        href = a.attributes["href"]
+        a.replace_with(f"[{label}]({href})" if label else href)
+    for node in root.css(_BLOCK_TAGS):
+        node.insert_before(_BREAK)
+        node.insert_after(_BREAK)
+    for node in root.css("br"):
+        node.insert_after(_BREAK)
+    text = _WS_RE.sub(" ", root.text(separator=""))
+    return _BREAK_RE.sub("\n", text).strip()
+
+def _iso(ts_ms: int) -> str:
+    # Naive UTC arithmetic: no tz conversion or strftime format parsing
+    return (_EPOCH + timedelta(seconds=ts_ms // 1000)).isoformat() + "Z"
 
 def _first_url(md: str) -> Optional[str]:
-    m = re.search(r"https?://[^\s\)\]]{12,}", md)
+    m = _URL_RE.search(md)
     return m.group(0) if m else None
 
+def _first_url_in_html(html: str) -> Optional[str]:
+    # Same link html2text would emit first, without rendering the markdown:
+    # first href/src in <body> (skips <head> stylesheets and xmlns URLs)
+    body = _BODY_RE.search(html)
+    m = _HTML_URL_RE.search(html, body.start() if body else 0)
+    return htmllib.unescape(m.group(1)) if m else None
+
 def _walk_for_html(payload: Dict[str, Any]) -> Optional[str]:
-    html = None
-    def walk(p):
-        nonlocal html
-        if "parts" in p:
-            for c in p["parts"]:
-                walk(c)
-        else:
-            if (p.get("mimeType") or "").startswith("text/html"):
-                data = p.get("body", {}).get("data")
-                if data:
-                    try:
-                        html_dec = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
-                        html = html_dec
-                    except Exception:
-                        pass
-    walk(payload)
-    return html
+    # Iterative DFS in document order; first decodable text/html part wins
+    stack = [payload]
+    while stack:
+        p = stack.pop()
+        parts = p.get("parts")
+        if parts:
+            stack.extend(reversed(parts))
+            continue
+        if (p.get("mimeType") or "").startswith("text/html"):
+            data = p.get("body", {}).get("data")
+            if data:
+                try:
+                    return base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
+                except Exception:
+                    pass
+    return None
 
 # ---------- Public API ----------
 def fetch_newsletters(window: dict, query: str) -> List[Dict[str, Any]]:
@@ -106,6 +283,7 @@ def fetch_newsletters(window: dict, query: str) -> List[Dict[str, Any]]:
 
     window:
       {"mode":"days","days":int}
+      or {"mode":"range","start_ms":epoch_ms,"end_ms":epoch_ms}
       or {"mode":"since_ts","since_ts":epoch_ms}
     query: Gmail search string from config.yaml (news_query)
 
@@ -117,7 +295,7 @@ def fetch_newsletters(window: dict, query: str) -> List[Dict[str, Any]]:
         "gmail_link": str|None,   # RFC822 search link (works in Gmail)
         "web_link": str|None,     # First URL found in body (for Sources section)
         "internal_ts": int,       # Gmail internal timestamp (ms)
-        "text": str               # Markdown version of email
+        "text": str               # Markdown version of email, first MAX_TEXT chars
       }
     """
     svc = _gmail_service()
@@ -125,57 +303,74 @@ def fetch_newsletters(window: dict, query: str) -> List[Dict[str, Any]]:
     # Build Gmail query
     if window["mode"] == "days":
         q = f"newer_than:{window['days']}d {query}"
+    elif window["mode"] == "range":
+        # Gmail accepts epoch seconds for after:/before:, so the window is applied server-side
+        q = f"after:{window['start_ms'] // 1000} before:{window['end_ms'] // 1000 + 1} {query}"
     else:
         # for since_ts we fetch with raw query and filter client-side by internalDate
         q = query
 
-    # Collect message IDs (paginate)
-    ids, token = [], None
-    while True:
-        resp = svc.users().messages().list(
-            userId="me", q=q, pageToken=token, maxResults=100
-        ).execute()
-        ids += [m["id"] for m in resp.get("messages", [])]
-        token = resp.get("nextPageToken")
-        if not token:
-            break
-
-    # Fetch full messages
-    items = []
-    for mid in ids:
-        m = svc.users().messages().get(userId="me", id=mid, format="full").execute()
+    # Pass 1: headers + internalDate only, so filtering/dedup happens before any body download.
+    # Each page is batched as soon as it's listed while the next page is still being fetched.
+    metas = {}
+    for page in _iter_id_pages(q):
+        metas.update(_fetch_messages(
+            svc, page, format="metadata", metadataHeaders=METADATA_HEADERS, fields=_METADATA_FIELDS
+        ))
+    # Exclusive lower / inclusive upper bound in ms. For "range" this is a guard only:
+    # Gmail's after:/before: work in whole seconds and round the window outwards.
+    if window["mode"] == "since_ts":
+        min_ts, max_ts = window["since_ts"], float("inf")
+    elif window["mode"] == "range":
+        min_ts, max_ts = window["start_ms"] - 1, window["end_ms"]
+    else:
+        min_ts, max_ts = -1, float("inf")
+    kept, seen = [], set()
+    for m in sorted(metas.values(), key=lambda x: int(x["internalDate"]), reverse=True):
         ts_ms = int(m["internalDate"])
+        if ts_ms <= min_ts or ts_ms > max_ts:
+            continue
+
+        hdr = _header_map(m["payload"].get("headers", []))
+        msgid = hdr.get("message-id")
+        key = msgid or m["id"]
+        if key in seen:
+            continue
+        seen.add(key)
+        kept.append((m, ts_ms, hdr, msgid))
 
-        if window["mode"] == "since_ts" and ts_ms <= window["since_ts"]:
+    # Pass 2: full payloads for survivors only
+    bodies = _fetch_messages(svc, [m["id"] for m, *_ in kept], format="full", fields=_BODY_FIELDS)
+    items = []
+    for m, ts_ms, hdr, msgid in kept:
+        full = bodies.get(m["id"])
+        if full is None:
             continue
 
-        headers = m["payload"].get("headers", [])
-        subject = _get_header(headers, "Subject") or "Newsletter"
-        sender = _get_header(headers, "From") or "unknown"
-        msgid = _get_header(headers, "Message-Id")
+        subject = hdr.get("subject") or "Newsletter"
+        sender = hdr.get("from") or "unknown"
 
         gmail_link = f"https://mail.google.com/mail/u/0/#search/rfc822msgid:{msgid}" if msgid else None
-        html = _walk_for_html(m["payload"])
-        body_md = _html_to_md(html) if html else (m.get("snippet") or "")
-        web_link = _first_url(body_md)
+        html = _walk_for_html(full["payload"])
+        if html:
+            web_link = _first_url_in_html(html)
+            body_md = _html_to_md(html)
+        else:
+            body_md = full.get("snippet") or ""
+            web_link = _first_url(body_md)
 
         items.append({
             "title": subject,
             "source": sender,
-            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts_ms/1000)),
+            "date": _iso(ts_ms),
             "gmail_link": gmail_link,
             "web_link": web_link,
             "internal_ts": ts_ms,
-            "text": body_md
+            "text": body_md[:MAX_TEXT]  # drop the rest of the body as early as possible
         })
 
-    # De-dup by web_link (fallback gmail_link), newest-first
-    dedup = {}
-    for it in sorted(items, key=lambda x: x["internal_ts"], reverse=True):
-        key = it["web_link"] or it["gmail_link"] or it["title"]
-        if key not in dedup:
-            dedup[key] = it
-    return list(dedup.values())
+    # Already newest-first and de-duped by Message-Id
+    return items
 
 def fetch_context(window: dict, query: str) -> List[Dict[str, Any]]:
     """
@@ -206,26 +401,24 @@ def fetch_context(window: dict, query: str) -> List[Dict[str, Any]]:
         # 'all' and 'since_ts' both run raw query, then filter if since_ts
         q = query
 
-    # Collect message IDs (paginate)
-    ids, token = [], None
-    while True:
-        resp = svc.users().messages().list(
-            userId="me", q=q, pageToken=token, maxResults=100
-        ).execute()
-        ids += [m["id"] for m in resp.get("messages", [])]
-        token = resp.get("nextPageToken")
-        if not token:
-            break
-
-    docs = []
-    for mid in ids:
-        m = svc.users().messages().get(userId="me", id=mid, format="full").execute()
+    # Batch each page of IDs while the next page is still being listed
+    msgs = {}
+    for page in _iter_id_pages(q):
+        msgs.update(_fetch_messages(svc, page, format="full", fields=_GET_FIELDS))
+
+    # Newest-first, de-duped by Message-Id before any HTML rendering
+    min_ts = window["since_ts"] if window["mode"] == "since_ts" else -1
+    docs, seen = [], set()
+    for mid, m in sorted(msgs.items(), key=lambda kv: int(kv[1]["internalDate"]), reverse=True):
         ts_ms = int(m["internalDate"])
-        if window["mode"] == "since_ts" and ts_ms <= window["since_ts"]:
+        if ts_ms <= min_ts:
             continue
 
-        headers = m["payload"].get("headers", [])
-        msgid = _get_header(headers, "Message-Id") or mid
+        hdr = _header_map(m["payload"].get("headers", []))
+        msgid = hdr.get("message-id") or mid
+        if msgid in seen:
+            continue
+        seen.add(msgid)
 
         html = _walk_for_html(m["payload"])
         text = _html_to_md(html) if html else (m.get("snippet") or "")
@@ -233,9 +426,8 @@ def fetch_context(window: dict, query: str) -> List[Dict[str, Any]]:
             "source": "gmail",
             "id": msgid,
             "text": text[:200_000],  # keep it sane
-            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts_ms/1000)),
+            "date": _iso(ts_ms),
             "ts_ms": ts_ms
         })
 
-    docs.sort(key=lambda d: d["ts_ms"], reverse=True)
     return docs
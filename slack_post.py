@@ -1,6 +1,11 @@
 # slack_post.py - Post AI briefs to Slack and handle threaded conversations
+import hashlib
+import json
 import os
 import pathlib
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
@@ -8,6 +13,22 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+REPLY_WORKERS = 4  # Concurrent thread replies per brief
+POSTED_INDEX = pathlib.Path(__file__).parent / "posted_index.json"
+
+# Markdown -> Slack mrkdwn, applied in order by _format_for_slack
+_H1_RE = re.compile(r"^# [ \t]*(.*?)[ \t]*$", re.M)
+_H2_RE = re.compile(r"^## [ \t]*(.*?)[ \t]*$", re.M)
+_H3_RE = re.compile(r"^### [ \t]*(.*?)[ \t]*$", re.M)
+_BULLET_RE = re.compile(r"^- [ \t]*(.*?)[ \t]*$", re.M)
+_HR_RE = re.compile(r"^[ \t]*---[ \t]*$", re.M)
+_BOLD_RE = re.compile(r"\*\*")
+_BLANK_RE = re.compile(r"^[ \t]+$", re.M)
+_SOURCES_START_RE = re.compile(r"^[^\S\n]*(?:---[^\S\n]*$|\*\*Sources)", re.M)
+_FRONTMATTER_RE = re.compile(r"\A---\n.*?^---[ \t]*\n\s*", re.M | re.S)  # YAML header written by weekly_agent
+_FMT_CACHE_SIZE = 64
+_FMT_CACHE: "OrderedDict[bytes, str]" = OrderedDict()  # blake2b(markdown) -> Slack text, LRU
+
 class SlackBriefPoster:
     def __init__(self):
         self.token = os.getenv("SLACK_BOT_TOKEN")
@@ -15,6 +36,8 @@ class SlackBriefPoster:
             raise ValueError("SLACK_BOT_TOKEN not found in environment variables")
         self.client = WebClient(token=self.token)
         self.channel = os.getenv("SLACK_CHANNEL", "#ai-brief")  # Default channel
+        # brief path -> posted-at timestamp, loaded once per run
+        self._posted = json.loads(POSTED_INDEX.read_text(encoding="utf-8")) if POSTED_INDEX.exists() else {}
     
     def post_brief(self, brief_content: str, brief_file_path: str = None, date_window: str = None) -> str:
         """
@@ -70,14 +93,9 @@ class SlackBriefPoster:
                 )
                 thread_ts = response["ts"]
                 
-                # Post remaining sections as threaded replies
-                for section in sections[1:]:
-                    self.client.chat_postMessage(
-                        channel=self.channel,
-                        text=section,
-                        thread_ts=thread_ts,
-                        mrkdwn=True
-                    )
+                # Remaining sections become threaded replies, numbered since they post concurrently
+                total = len(sections)
+                replies = [f"_Part {i}/{total}_\n{section}" for i, section in enumerate(sections[1:], start=2)]
             else:
                 # Post as single message
                 response = self.client.chat_postMessage(
@@ -86,16 +104,14 @@ class SlackBriefPoster:
                     mrkdwn=True
                 )
                 thread_ts = response["ts"]
+                replies = []
             
             # Post sources as a threaded reply
             if sources_content:
                 sources_formatted = self._format_for_slack(sources_content)
-                self.client.chat_postMessage(
-                    channel=self.channel,
-                    text=f"📚 *Sources*\n{sources_formatted}",
-                    thread_ts=thread_ts,
-                    mrkdwn=True
-                )
+                replies.append(f"📚 *Sources*\n{sources_formatted}")
+            
+            self._post_replies(thread_ts, replies)
             
             # Mark this brief as posted
             if brief_file_path:
@@ -114,63 +130,56 @@ class SlackBriefPoster:
                 print(f"   Invite the bot to {self.channel} with: /invite @your-bot-name")
             raise
     
+    def _post_replies(self, thread_ts: str, replies: list[str]):
+        """
+        Post thread replies concurrently (each is a blocking HTTPS call).
+        Slack may interleave them, so callers number multi-part content.
+        """
+        def _post(text):
+            return self.client.chat_postMessage(
+                channel=self.channel,
+                text=text,
+                thread_ts=thread_ts,
+                mrkdwn=True
+            )
+        
+        with ThreadPoolExecutor(max_workers=REPLY_WORKERS) as ex:
+            list(ex.map(_post, replies))  # re-raises the first SlackApiError
+    
     def _format_for_slack(self, markdown_content: str) -> str:
         """
         Convert markdown to Slack-friendly formatting.
         """
-        lines = markdown_content.split('\n')
-        formatted_lines = []
+        key = hashlib.blake2b(markdown_content.encode("utf-8"), digest_size=8).digest()
+        cached = _FMT_CACHE.get(key)
+        if cached is not None:
+            _FMT_CACHE.move_to_end(key)
+            return cached
         
-        for line in lines:
-            # Handle headers
-            if line.startswith('# '):
-                formatted_lines.append(f"*{line[2:].strip()}*")
-            elif line.startswith('## '):
-                formatted_lines.append(f"\n*{line[3:].strip()}*")
-            elif line.startswith('### '):
-                formatted_lines.append(f"\n_{line[4:].strip()}_")
-            # Handle bullet points
-            elif line.startswith('- '):
-                # Convert [n] citations to links if possible
-                bullet_text = line[2:].strip()
-                formatted_lines.append(f"• {bullet_text}")
-            # Handle horizontal rules
-            elif line.strip() == '---':
-                formatted_lines.append("\n━━━━━━━━━━━━━━━━━━━━\n")
-            # Handle bold markdown
-            elif '**' in line:
-                # Convert **text** to *text* for Slack
-                converted = line.replace('**', '*')
-                formatted_lines.append(converted)
-            # Regular lines
-            elif line.strip():
-                formatted_lines.append(line)
-            else:
-                formatted_lines.append("")
+        text = _H1_RE.sub(r"*\1*", markdown_content)
+        text = _H2_RE.sub(r"\n*\1*", text)
+        text = _H3_RE.sub(r"\n_\1_", text)
+        text = _BULLET_RE.sub(r"• \1", text)
+        text = _HR_RE.sub("\n━━━━━━━━━━━━━━━━━━━━\n", text)
+        text = _BOLD_RE.sub("*", text)  # **text** -> *text*
+        text = _BLANK_RE.sub("", text)
         
-        return '\n'.join(formatted_lines)
+        _FMT_CACHE[key] = text
+        if len(_FMT_CACHE) > _FMT_CACHE_SIZE:
+            _FMT_CACHE.popitem(last=False)
+        return text
     
     def _split_brief_and_sources(self, content: str) -> tuple[str, str]:
         """
         Split the brief content into main content and sources section.
         """
-        lines = content.split('\n')
-        sources_start = -1
-        
-        # Find where sources section starts
-        for i, line in enumerate(lines):
-            if line.strip() == '---' or line.strip().startswith('**Sources'):
-                sources_start = i
-                break
-        
-        if sources_start == -1:
+        # Sources start at the first '---' line or '**Sources' line
+        m = _SOURCES_START_RE.search(content)
+        if not m:
             # No sources section found
             return content, ""
         
-        main_content = '\n'.join(lines[:sources_start]).strip()
-        sources_content = '\n'.join(lines[sources_start:]).strip()
-        
-        return main_content, sources_content
+        return content[:m.start()].strip(), content[m.start():].strip()
     
     def _split_at_sections(self, content: str, max_length: int = 3800) -> list[str]:
         """
@@ -178,32 +187,32 @@ class SlackBriefPoster:
         """
         lines = content.split('\n')
         sections = []
-        current_section = ""
+        # Current section as a list buffer (joined once per boundary, not += per line)
+        buf: list[str] = []
+        buf_len = 0
+        has_text = False
         
         for line in lines:
             # Check if this is a new section header
-            if line.strip().startswith('*') and not current_section:
-                # First section, start building
-                current_section = line + '\n'
-            elif line.strip().startswith('*') and current_section:
+            if line.strip().startswith('*'):
                 # New section header, finish current section
-                if current_section.strip():
-                    sections.append(current_section.strip())
-                current_section = line + '\n'
+                if has_text:
+                    sections.append("".join(buf).strip())
+                buf, buf_len, has_text = [line, '\n'], len(line) + 1, bool(line.strip())
+            # If adding this line would exceed limit, finish section
+            elif buf_len + len(line) + 1 > max_length and has_text:
+                sections.append("".join(buf).strip())
+                buf, buf_len, has_text = [line, '\n'], len(line) + 1, bool(line.strip())
             else:
                 # Add to current section
-                potential_section = current_section + line + '\n'
-                
-                # If adding this line would exceed limit, finish section
-                if len(potential_section) > max_length and current_section.strip():
-                    sections.append(current_section.strip())
-                    current_section = line + '\n'
-                else:
-                    current_section = potential_section
+                buf.append(line)
+                buf.append('\n')
+                buf_len += len(line) + 1
+                has_text = has_text or bool(line.strip())
         
         # Add the last section
-        if current_section.strip():
-            sections.append(current_section.strip())
+        if has_text:
+            sections.append("".join(buf).strip())
         
         # If no sections were found, fall back to simple splitting
         if not sections:
@@ -215,15 +224,16 @@ class SlackBriefPoster:
         """
         Check if this brief file has already been posted to Slack.
         """
-        posted_file = pathlib.Path(brief_file_path + ".slack_posted")
-        return posted_file.exists()
+        return brief_file_path in self._posted
     
     def _mark_as_posted(self, brief_file_path: str):
         """
         Mark this brief file as posted to Slack.
         """
-        posted_file = pathlib.Path(brief_file_path + ".slack_posted")
-        posted_file.write_text(datetime.utcnow().isoformat(), encoding="utf-8")
+        self._posted[brief_file_path] = datetime.utcnow().isoformat()
+        tmp = POSTED_INDEX.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._posted, indent=2), encoding="utf-8")
+        os.replace(tmp, POSTED_INDEX)  # atomic swap, never a half-written index
     
     def _split_content(self, content: str, max_length: int = 3500) -> list[str]:
         """Split content into chunks that fit within Slack's message limits."""
@@ -232,23 +242,28 @@ class SlackBriefPoster:
         
         chunks = []
         lines = content.split('\n')
-        current_chunk = ""
+        buf: list[str] = []
+        buf_len = 0
         
         for line in lines:
             # If adding this line would exceed the limit, start a new chunk
-            if len(current_chunk) + len(line) + 1 > max_length:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = line + '\n'
+            if buf_len + len(line) + 1 > max_length:
+                if buf_len:
+                    chunks.append("".join(buf).strip())
+                    buf, buf_len = [line, '\n'], len(line) + 1
                 else:
                     # Single line is too long, force split
                     chunks.append(line[:max_length])
-                    current_chunk = line[max_length:] + '\n'
+                    rest = line[max_length:]
+                    buf, buf_len = [rest, '\n'], len(rest) + 1
             else:
-                current_chunk += line + '\n'
+                buf.append(line)
+                buf.append('\n')
+                buf_len += len(line) + 1
         
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+        last = "".join(buf).strip()
+        if last:
+            chunks.append(last)
         
         return chunks
     
@@ -288,6 +303,8 @@ def post_brief_to_slack(brief_file_path: str) -> str:
     """
     with open(brief_file_path, 'r', encoding='utf-8') as f:
         content = f.read()
+    # Saved briefs open with YAML frontmatter; its '---' would otherwise be taken as the sources split
+    content = _FRONTMATTER_RE.sub("", content, count=1)
     
     poster = SlackBriefPoster()
     return poster.post_brief(content, brief_file_path)
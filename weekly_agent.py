@@ -1,11 +1,35 @@
 #!/usr/bin/env python3
-# weekly_agent.py - Simple weekly AI brief: 30-day email sweep + team context → Slack
-
+# weekly_agent.py - Simple weekly AI brief: Thu→Thu email sweep + team context → Slack
+
+import argparse
+import contextlib
+import csv
+import functools
+import hashlib
+import heapq
+import importlib.util
+import io
+import itertools
+import json
 import os
 import pathlib
+import re
+import shutil
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
 from zoneinfo import ZoneInfo
 import yaml
+try:  # libyaml bindings when PyYAML was built with them
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+try:  # optional: Rust JSON encoder for the prompt payloads
+    import orjson
+except ImportError:
+    orjson = None
 from anthropic import Anthropic
 from dotenv import load_dotenv
 
@@ -18,33 +42,327 @@ ROOT = pathlib.Path(__file__).parent
 # Point to Pulse folder for team context
 PULSE_DIR = pathlib.Path.home() / "Desktop/library/design-projects/vaults/pulse"
 CONTEXT_DIR = PULSE_DIR / "context"
+_TZ = ZoneInfo("America/Denver")  # resolved once; ZoneInfo reads tzdata on first use
+
+_BULLET_B = "•".encode()
+_ARROW_B = "→".encode()
+# Brief key-point line: '• topic → ...' bullet, or '**Bold lead-in.**'; matched on raw bytes
+_KEY_POINT_RE = re.compile(
+    re.escape(_BULLET_B) + rb" (.*?)(?:" + re.escape(_BULLET_B) + rb"|" + re.escape(_ARROW_B) + rb"|$)"
+    rb"|\*\*(.*?)(?:\*\*|$)"
+)
+MAX_KEY_POINTS = 8
+
+# Subject normalization for duplicate detection
+_SUBJECT_PREFIX_RE = re.compile(r"^\s*(?:(?:re|fwd?)\s*:\s*)+")
+_WS_RE = re.compile(r"\s+")
+
+# Near-duplicate bodies (same announcement quoted by several newsletters)
+_WORD_RE = re.compile(r"\w+")
+SIMHASH_CHARS = 2000  # body prefix fingerprinted per email
+SIMHASH_MAX_DISTANCE = 6  # differing bits (of 64) still counted as the same story; unrelated text sits near 32
+
+# path -> (mtime_ns, limit, content) for team-context files
+_FILE_CACHE: dict[pathlib.Path, tuple[int, int, str]] = {}
+
+_ANTHROPIC = None
+
+def _client() -> Anthropic:
+    """One Anthropic client per process, so both Claude calls share its connection pool"""
+    global _ANTHROPIC
+    if _ANTHROPIC is None:
+        _ANTHROPIC = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    return _ANTHROPIC
+
+# Stage-1 structured output: indexes into the email list
+PRIORITY_TOOL = {
+    "name": "prioritize",
+    "description": "Record which emails are most relevant and somewhat relevant to the team, by index.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "high_priority": {"type": "array", "items": {"type": "integer"}},
+            "medium_priority": {"type": "array", "items": {"type": "integer"}},
+        },
+        "required": ["high_priority", "medium_priority"],
+    },
+}
+
+PRIORITY_MODEL = "claude-3-5-haiku-latest"  # Stage 1 is classification over headers
+BRIEF_MODEL = "claude-3-7-sonnet-20250219"   # Stage 2 writes the brief
+EMBED_MODEL = "all-MiniLM-L6-v2"  # STAGE1_RANKER=embeddings or auto: local Stage 1 ranking model
+STAGE1_SCORE_GAP = 0.3  # STAGE1_RANKER=auto: cosine gap between ranks 20 and 26 that makes Claude unnecessary (>20 emails only)
+
+# Run the Stage-1 priority scan only above this estimated email payload. Calibrated
+# to the old "more than 20 emails" rule: 20 emails x 3000 chars ≈ 15k tokens.
+STAGE1_TOKEN_THRESHOLD = 15_000
+EMAIL_TOKENS = 700    # per-email text budget in the Stage-2 prompt
+SUMMARY_TOKENS = 125  # per-email text budget for medium-priority summaries
+# Stage-2 prompt token budgets per dynamic section
+BUDGET = {"team": 800, "prev": 500, "emails": 6000}
+
+PRIORITY_RETRY_NUDGE = (
+    "\n\nRespond only by calling the prioritize tool, with integer index lists "
+    "for high_priority and medium_priority. No prose."
+)
+
+# Deep-analysis prompt: static text lives here once; generate_weekly_brief
+# splices the per-run sections in between with "".join. Everything up to and
+# including PROMPT_FORMAT is the prompt-cached prefix; the emails are the tail.
+PROMPT_VOICE = """You are writing a weekly AI brief in the voice of Jason Fried.
+
+VOICE — THIS IS CRITICAL:
+Calm confidence. No hedging. Short sentences that land. State things as facts, then let the reader sit with them.
+> "What was simple is now complicated. What was clear is now cluttered. What just worked now takes work."
+
+RULES:
+1. Cut 70% of the words. If it can be shorter, make it shorter.
+2. Specific over abstract. "Claude Code grew up" not "The tools are settling"
+3. Trust the reader. No "what this means for you", no "Worth watching:" or "Solves:" labels, no time estimates.
+4. End each section with a punch. Calm, not excited: no exclamation points, no "game-changing."
+5. No bullet points for steps. Collapse to one line.
+
+NEVER USE: "comprehensive", "significant" (be specific), "utilize" or "leverage" (say "use"), "implement" (say "build")."""
+
+PROMPT_HEAD = PROMPT_VOICE + """
+
+TEAM CONTEXT (for relevance filtering, not for explicit mention):
+"""
+
+PROMPT_MID = """
+
+PREVIOUS BRIEFS (avoid repetition):
+"""
+
+PROMPT_EMAILS_HDR = """NEWSLETTERS FROM {window} (JSON follows):
+"""
+
+PROMPT_FORMAT = """
+
+---
+
+OUTPUT FORMAT — FOLLOW EXACTLY:
+
+# [Headline grounded in specific content]
+
+The headline must be specific. Not "AI Tools Mature" — instead "Claude Code grew up and now other tools can follow"
+Formula: [Specific thing that happened] + [what it means]
+
+## What Actually Happened
+
+**[Most important thing. Bold, declarative, like a headline].** (Date)
+
+[2-3 short paragraphs. State facts with confidence. No "What it is:" labels. End with insight, not summary. The last sentence should punch.]
+
+**[Second thing].** (Date)
+
+[1-2 paragraphs. Shorter than the first. End with punch.]
+
+**[Third thing].** (Date)
+
+[1-2 paragraphs. Can be very brief. End with punch.]
+
+---
+
+## Worth Your Attention
+
+**[Topic as conversational hook, not formal title]** (Date)
+
+[2-3 sentences. The point, not the details. Trust the reader.]
+
+**[Topic]** (Date)
+
+[1-2 sentences. Even shorter.]
+
+**[Topic]**
+
+[One sentence is fine.]
+
+---
+
+## Things to Try
+
+**[Action in bold].** [One sentence of context. No bullet points. Simple.]
+
+**[Action].** [Context.]
+
+**[Action].** [Context.]
+
+---
+
+## The Pattern
+
+[The meta-insight in 2-3 sentences. What did this week reveal about where things are going? End with punch.]
+
+---
+
+*Sources: [comma-separated list]*
+
+---
+
+EXAMPLE OF CORRECT VOICE:
+
+BAD (verbose, labeled):
+**Claude Code Updates** (Jan 22-29)
+**What it is:** Anthropic released several updates to Claude Code this week including VS Code extension GA, a new desktop app called Cowork, and a diff viewer on web.
+**What it means for you:** This represents a significant maturation of the tooling. Teams should consider...
+
+GOOD (Jason Fried voice):
+**Claude Code grew up.** (Jan 22-29)
+Anthropic shipped a lot this month. The VS Code extension hit general availability. A desktop app called Cowork launched for non-coding tasks. A diff viewer showed up on web.
+But here's what matters: these aren't features for early adopters anymore. They're features for everyone else. Less configuration, more just working."""
+
+BATCH_POLL_SECONDS = 30  # --batch: how often to check on a submitted Message Batch
+
+def _create_message(params: dict, use_batch: bool, custom_id: str):
+    """
+    messages.create(**params), or with use_batch the same request sent through
+    the Message Batches API: half the price, but results take minutes to hours.
+    """
+    if not use_batch:
+        return _client().messages.create(**params)
+
+    client = _client()
+    batch = client.messages.batches.create(requests=[{"custom_id": custom_id, "params": params}])
+    print(f"⏳ Submitted {custom_id} request as batch {batch.id}, waiting for results...")
+    while batch.processing_status != "ended":
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.messages.batches.retrieve(batch.id)
+
+    for entry in client.messages.batches.results(batch.id):
+        if entry.custom_id == custom_id:
+            if entry.result.type != "succeeded":
+                raise RuntimeError(f"Batch {batch.id} {custom_id} request {entry.result.type}")
+            return entry.result.message
+    raise RuntimeError(f"Batch {batch.id} returned no result for {custom_id}")
+
+def _user_message(prefix: str, tail: str) -> list[dict]:
+    """
+    One user turn as two text blocks, with the stable prefix marked for
+    Anthropic prompt caching so repeat calls within the cache TTL skip it.
+    """
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": tail},
+        ],
+    }]
+
+def _to_json(obj) -> str:
+    """Compact UTF-8 JSON for prompts (no indentation: whitespace is billed as tokens)"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+@functools.cache
+def _enc():
+    """cl100k_base tokenizer (close enough to Claude's for budgeting), or None without tiktoken"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")  # downloads the vocabulary on first use
+    except Exception as e:
+        print(f"⚠️  Tokenizer unavailable ({e.__class__.__name__}), budgeting by characters")
+        return None
+
+def _truncate_tokens(text: str, n: int) -> str:
+    """First ~n tokens of text; falls back to ~4 chars/token without tiktoken"""
+    enc = _enc()
+    if enc is None:
+        return text[:n * 4]
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= n else enc.decode(ids[:n])
+
+def _count_tokens(text: str) -> int:
+    enc = _enc()
+    if enc is None:
+        return -(-len(text) // 4)
+    return len(enc.encode(text, disallowed_special=()))
+
+def _share_budget(email_data: list[dict], budget: int) -> list[dict]:
+    """
+    Shrink each email's text so all of them fit in `budget` tokens together,
+    each getting an equal share (never more than EMAIL_TOKENS of text).
+    """
+    if not email_data:
+        return email_data
+    share = (budget - 2) // len(email_data)  # less the enclosing brackets
+    shared = []
+    for d in email_data:
+        text_budget = share - _count_tokens(_to_json({**d, "text": ""})) - 1  # and its comma
+        if text_budget < EMAIL_TOKENS:
+            d = {**d, "text": _truncate_tokens(d["text"], max(text_budget, 0))}
+        shared.append(d)
+    return shared
+
+def _fit_to_budget(items: list[dict], budget: int) -> list[dict]:
+    """Leading items whose JSON fits in `budget` tokens; whole records only, never cut mid-object"""
+    kept, used = [], 2  # the enclosing brackets
+    for item in items:
+        used += _count_tokens(_to_json(item)) + 1
+        if used > budget:
+            print(f"✂️  Token budget reached: sending {len(kept)} of {len(items)} emails")
+            break
+        kept.append(item)
+    return kept
+
+@functools.cache
+def load_config() -> dict:
+    """Parsed config.yaml; read once per process"""
+    return yaml.load((ROOT / "config.yaml").read_text(), Loader=_YamlLoader)
 
 def get_thursday_window():
     """
     Calculate Thu→Thu window for weekly brief (America/Denver timezone).
     Returns dict with start/end dates and formatted string for display.
     """
-    tz = ZoneInfo("America/Denver")
-    now = datetime.now(tz)
+    now = datetime.now(_TZ)
+    end_ms = int(now.timestamp() * 1000)
 
     # Use current week ending today for fresh news
     end_date = now
     start_date = end_date - timedelta(days=7)
 
     # Format for display: "Oct 31–Nov 7"
-    if start_date.month == end_date.month:
-        date_str = f"{start_date.strftime('%b %d')}–{end_date.strftime('%d')}"
-    else:
-        date_str = f"{start_date.strftime('%b %d')}–{end_date.strftime('%b %d')}"
+    start_fmt = start_date.strftime('%b %d')
+    end_fmt = end_date.strftime('%d' if start_date.month == end_date.month else '%b %d')
+    date_str = f"{start_fmt}–{end_fmt}"
 
     return {
         "start": start_date,
         "end": end_date,
         "display": date_str,
-        "start_ms": int(start_date.timestamp() * 1000),
-        "end_ms": int(end_date.timestamp() * 1000)
+        "start_ms": end_ms - 7 * 86_400_000,
+        "end_ms": end_ms
     }
 
+def _read_prefix(path: pathlib.Path, limit: int) -> str:
+    """Read at most `limit` bytes of a UTF-8 file (a split trailing character is dropped)."""
+    with path.open('rb') as f:
+        return f.read(limit).decode('utf-8', 'ignore')
+
+def _read_cached(path: pathlib.Path, limit: int) -> str:
+    """_read_prefix, served from memory while the file's mtime is unchanged"""
+    mtime_ns = path.stat().st_mtime_ns
+    cached = _FILE_CACHE.get(path)
+    if cached is not None and cached[0] == mtime_ns and cached[1] == limit:
+        return cached[2]
+    content = _read_prefix(path, limit)
+    _FILE_CACHE[path] = (mtime_ns, limit, content)  # one entry per path: an edit replaces it
+    return content
+
+def _recent_md(d: pathlib.Path, n: int, exclude: Optional[str] = None) -> list[pathlib.Path]:
+    """
+    The n most recently modified .md files in d, newest first. One scandir pass
+    (DirEntry caches stat) and a bounded heap instead of a full sort.
+    """
+    with os.scandir(d) as it:
+        entries = [(e.stat().st_mtime, e.path) for e in it if e.name.endswith(".md") and e.name != exclude]
+    return [pathlib.Path(p) for _, p in heapq.nlargest(n, entries)]
+
 def load_team_context() -> str:
     """Load team context files from Pulse folder for curation lens"""
     context_parts = []
@@ -52,19 +370,18 @@ def load_team_context() -> str:
     # Team overview from Pulse
     team_file = CONTEXT_DIR / "team-overview.md"
     if team_file.exists():
-        context_parts.append(f"TEAM CONTEXT:\n{team_file.read_text(encoding='utf-8')[:10000]}")
+        context_parts.append(f"TEAM CONTEXT:\n{_read_cached(team_file, 10000)}")
     else:
         print(f"⚠️  Team overview not found: {team_file}")
 
     # Latest 3 meeting notes from Pulse
     meet_dir = CONTEXT_DIR / "meet"
     if meet_dir.exists():
-        # Get 3 newest files by modification time
-        meet_files = sorted(meet_dir.glob("*.md"), key=lambda x: x.stat().st_mtime, reverse=True)[:3]
+        meet_files = _recent_md(meet_dir, 3)
         if meet_files:
             meeting_context = []
             for f in meet_files:
-                meeting_context.append(f"MEETING: {f.name}\n{f.read_text(encoding='utf-8')[:4000]}")
+                meeting_context.append(f"MEETING: {f.name}\n{_read_cached(f, 4000)}")
             context_parts.append("RECENT MEETINGS:\n" + "\n---\n".join(meeting_context))
         else:
             print(f"⚠️  No meeting notes found in {meet_dir}")
@@ -77,147 +394,357 @@ def load_team_context() -> str:
 
     return "\n\n".join(context_parts)
 
-def load_previous_briefs() -> str:
-    """Load recent brief history to avoid repetition and build continuity"""
+def _brief_filename() -> str:
+    """Name of the brief this run writes (one per day; a re-run overwrites it)"""
+    return f"{datetime.now().strftime('%Y-%m-%d')}-weekly.md"
+
+def load_previous_briefs() -> list[dict]:
+    """Load key points from recent briefs to avoid repetition and build continuity"""
     weekly_dir = ROOT / "summaries" / "weekly"
     if not weekly_dir.exists():
-        return "No previous briefs found."
+        return []
     
-    # Get the 3 most recent weekly briefs
-    brief_files = sorted(weekly_dir.glob("*.md"), key=lambda x: x.stat().st_mtime, reverse=True)[:3]
+    # Get the 3 most recent weekly briefs, not counting today's, which this run replaces
+    brief_files = _recent_md(weekly_dir, 3, exclude=_brief_filename())
     
-    if not brief_files:
-        return "No previous briefs found."
-    
-    brief_summaries = []
+    briefs = []
     for brief_file in brief_files:
         try:
-            content = brief_file.read_text(encoding='utf-8')
-            # Extract key topics/tools mentioned for continuity
-            lines = content.split('\n')
-            brief_summary = f"FILE: {brief_file.name}\n"
-            
-            # Get the main sections to understand what was covered
-            current_section = None
-            key_points = []
-            
-            for line in lines[:50]:  # First 50 lines should cover main content
-                if line.startswith('## '):
-                    current_section = line.strip()
-                elif line.startswith('• ') and current_section:
-                    # Extract the main topic from each bullet
-                    topic = line.split('•')[1].strip().split('→')[0].strip()
-                    if len(topic) > 10:  # Only meaningful topics
-                        key_points.append(f"{current_section}: {topic[:100]}")
-            
-            brief_summary += "\n".join(key_points[:8])  # Top 8 key points
-            brief_summaries.append(brief_summary)
-            
+            briefs.append({"file": brief_file.name, "key_points": _brief_key_points(brief_file)})
         except Exception as e:
             print(f"Warning: Could not read {brief_file}: {e}")
             continue
     
-    return "\n\n---\n\n".join(brief_summaries)
+    return briefs
 
-def generate_weekly_brief() -> str:
-    """Generate weekly brief from emails + context"""
+def _render_previous_briefs(briefs: list[dict]) -> str:
+    """Compact '- section: topic' list for the prompt"""
+    # Sidecars cached before frontmatter still carry the '## ' heading marker
+    rendered = "\n".join(f"- {kp.removeprefix('## ')}" for brief in briefs for kp in brief["key_points"][:6])
+    return rendered or "No previous briefs found."
 
-    # 1. Calculate Thu→Thu window
-    window = get_thursday_window()
-    print(f"📅 Coverage window: {window['display']}")
+def _brief_key_points(brief_file: pathlib.Path) -> list[str]:
+    """
+    Key topics covered by a brief. New briefs carry them in YAML frontmatter
+    written by main(); older ones are line-scanned once and the result cached
+    in a <brief>.summary.json sidecar, reused while it's at least as new as
+    the brief.
+    """
+    frontmatter = _read_frontmatter(brief_file)
+    if isinstance(frontmatter.get("key_topics"), list):
+        return frontmatter["key_topics"]
 
-    # 2. Load configuration
-    config = yaml.safe_load((ROOT / "config.yaml").read_text())
+    sidecar = brief_file.with_suffix(".summary.json")
+    try:
+        if sidecar.stat().st_mtime >= brief_file.stat().st_mtime:
+            return json.loads(sidecar.read_text(encoding='utf-8'))["key_points"]
+    except (OSError, ValueError, KeyError):
+        pass  # missing/stale/corrupt sidecar -> re-parse
 
-    # 3. Load team context
-    team_context = load_team_context()
+    with brief_file.open('rb') as f:
+        key_points = _extract_key_points(itertools.islice(f, 50))  # First 50 lines should cover main content
+    try:
+        sidecar.write_text(json.dumps({"file": brief_file.name, "key_points": key_points}), encoding='utf-8')
+    except OSError as e:
+        print(f"Warning: Could not cache summary for {brief_file.name}: {e}")
+    return key_points
 
-    # 4. Load previous briefs for continuity
-    print("📚 Loading previous brief history...")
-    previous_briefs = load_previous_briefs()
+def _extract_key_points(lines) -> list[str]:
+    """
+    Extract key topics/tools mentioned for continuity from raw brief lines:
+    '•' bullets and bold lead-ins ('**Claude Code grew up.**') under '## ' sections.
+    Scans bytes and decodes only the lines we keep.
+    """
+    current_section = None
+    key_points = []
+    
+    for raw in lines:
+        if raw.startswith(b'## '):
+            current_section = raw[3:].decode('utf-8', 'ignore').strip()
+            continue
+        if not current_section:
+            continue
+        m = _KEY_POINT_RE.match(raw)
+        if not m:
+            continue
+        # Bullet: text after '•', before '→'; bold lead-in: text inside '**', minus the period
+        topic = m[1] if m[1] is not None else m[2].rstrip(b'.')
+        topic = topic.decode('utf-8', 'ignore').strip()
+        if len(topic) > 10:  # Only meaningful topics
+            key_points.append(f"{current_section}: {topic[:100]}")
+            if len(key_points) == MAX_KEY_POINTS:
+                break  # Top 8 key points; the rest of the brief isn't needed
+    
+    return key_points
+
+def _read_frontmatter(brief_file: pathlib.Path) -> dict:
+    """Parse the leading '---' YAML block of a brief, or {} if it has none"""
+    with brief_file.open(encoding='utf-8', errors='replace') as f:
+        if f.readline().rstrip() != "---":
+            return {}
+        block = []
+        for line in itertools.islice(f, 40):
+            if line.rstrip() == "---":
+                try:
+                    data = yaml.load("".join(block), Loader=_YamlLoader)
+                except yaml.YAMLError:
+                    return {}
+                return data if isinstance(data, dict) else {}
+            block.append(line)
+    return {}
+
+def _with_frontmatter(brief: str, window: dict) -> str:
+    """Prefix the brief with date/window/key_topics so later runs needn't re-parse it"""
+    meta = {
+        "date": window["end"].date().isoformat(),
+        "window": window["display"],
+        "key_topics": _extract_key_points(brief.encode("utf-8").splitlines()),
+    }
+    return f"---\n{yaml.safe_dump(meta, allow_unicode=True, sort_keys=False)}---\n\n{brief}"
 
-    # 5. Fetch emails from Thu→Thu window (using 30-day buffer for safety)
-    print(f"📧 Fetching emails from last 30 days (filtering to {window['display']})...")
-    emails = fetch_newsletters({"mode": "days", "days": 30}, config["news_query"])
+def _dedup_emails(emails: list[dict]) -> list[dict]:
+    """
+    Drop repeat sends of the same newsletter, keyed on (source, title) with
+    case, Re:/Fwd: prefixes and whitespace normalized. Input is newest-first,
+    so the newest copy is kept.
+    """
+    seen = set()
+    deduped = []
+    for e in emails:
+        # Dates and part numbers stay in the key: they tell a daily's issues apart
+        title = _SUBJECT_PREFIX_RE.sub("", e["title"].lower())
+        key = (e["source"].lower().strip(), _WS_RE.sub(" ", title).strip())
+        if key in seen:
+            continue
+        seen.add(key)
+        deduped.append(e)
 
-    # Filter to Thu→Thu window
-    emails = [e for e in emails if window['start_ms'] <= e['internal_ts'] <= window['end_ms']]
-    print(f"📊 Found {len(emails)} emails in {window['display']} window")
+    if len(deduped) < len(emails):
+        print(f"🧹 Dropped {len(emails) - len(deduped)} duplicate emails")
+    return deduped
 
-    # 6. Two-stage processing to handle ALL emails
-    if len(emails) > 20:
-        print(f"🤖 Using two-stage processing for all {len(emails)} emails...")
-        
-        # STAGE 1: Quick prioritization scan of ALL email titles
-        print("Stage 1: Prioritizing emails by relevance...")
-        email_headers = [{
-            "title": email["title"],
-            "source": email["source"],
-            "date": email["date"][:10],  # Just date, not time
-            "index": i
-        } for i, email in enumerate(emails)]
-        
-        # Initialize anthropic client for priority analysis
-        anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        
-        priority_prompt = f"""You are filtering AI emails for a design/development consultancy team focused on systematic AI workflows.
+def _simhash(text: str) -> Optional[int]:
+    """64-bit SimHash over word 3-grams, or None if the text is too short to fingerprint"""
+    words = _WORD_RE.findall(text[:SIMHASH_CHARS].lower())
+    if len(words) < 10:
+        return None
+    weights = [0] * 64
+    for i in range(len(words) - 2):
+        shingle = " ".join(words[i:i + 3]).encode("utf-8")
+        h = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, w in enumerate(weights) if w > 0)
+
+def _collapse_near_duplicates(emails: list[dict]) -> list[dict]:
+    """
+    Collapse emails from different senders whose bodies are near-identical
+    (SimHash within SIMHASH_MAX_DISTANCE bits) into one: the longest body,
+    placed where the newest copy was, with the other senders listed under
+    "also_covered". Input is newest-first.
+    """
+    clusters: list[tuple[int, list[dict]]] = []  # (fingerprint of first member, members)
+    order: list[list[dict]] = []
+    for e in emails:
+        fp = _simhash(e["text"])
+        if fp is not None:
+            for kept_fp, members in clusters:
+                # Same-sender repeats are _dedup_emails' job; a shared template must not merge two issues
+                if (all(m["source"] != e["source"] for m in members)
+                        and bin(fp ^ kept_fp).count("1") <= SIMHASH_MAX_DISTANCE):
+                    members.append(e)
+                    break
+            else:
+                clusters.append((fp, [e]))
+                order.append(clusters[-1][1])
+        else:
+            order.append([e])
 
-TEAM FOCUS: {team_context[:2000]}
+    collapsed = []
+    for members in order:
+        if len(members) == 1:
+            collapsed.append(members[0])
+            continue
+        rep = max(members, key=lambda m: len(m["text"]))
+        others = list(dict.fromkeys(m["source"] for m in members if m is not rep and m["source"] != rep["source"]))
+        collapsed.append({**rep, "also_covered": others} if others else rep)
+
+    if len(collapsed) < len(emails):
+        print(f"🧹 Collapsed {len(emails) - len(collapsed)} near-duplicate emails")
+    return collapsed
+
+def _prioritize_with_claude(emails: list[dict], team_context: str, use_batch: bool) -> tuple[list[int], list[int]]:
+    """Stage 1 via Claude: (high, medium) priority email indexes from a scan of the headers"""
+    # One CSV row per email: column names once instead of repeated per record
+    header_buf = io.StringIO()
+    header_csv = csv.writer(header_buf, lineterminator="\n")
+    header_csv.writerow(["idx", "date", "source", "title"])
+    header_csv.writerows(
+        (i, email["date"][:10], email["source"], email["title"])  # Just date, not time
+        for i, email in enumerate(emails)
+    )
+    
+    priority_prefix = f"""You are filtering AI emails for a design/development consultancy team focused on systematic AI workflows.
 
-EMAIL HEADERS TO PRIORITIZE:
-{yaml.dump(email_headers, default_flow_style=False)}
+TEAM FOCUS: {team_context[:2000]}
 
-Return JSON with two lists:
-{{
-  "high_priority": [0, 5, 12, ...],  // indexes of most relevant emails
-  "medium_priority": [2, 8, 15, ...]  // indexes of somewhat relevant emails
-}}
+Call the prioritize tool with two lists of indexes:
+- high_priority: indexes of most relevant emails
+- medium_priority: indexes of somewhat relevant emails
 
 Prioritize emails about: tools/workflows, agent orchestration, systematic approaches, practical implementations, JASON FRIED content.
 Give HIGHEST priority to: Jason Fried tweets/content, major tool updates, workflow insights from team's existing tools.
 Skip: pure research, consumer features, general AI hype.
 
 BIAS TOWARD RECENT CONTENT: Give extra weight to emails from the last 7 days for breaking developments."""
-        
-        priority_response = anthropic_client.messages.create(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=800,
+    priority_tail = f"""EMAIL HEADERS TO PRIORITIZE (CSV, idx is the index to return):
+{header_buf.getvalue()}"""
+    
+    # Forced tool call: the answer comes back as a schema-checked object, not prose to parse.
+    # One retry with an explicit reminder before giving up on the Stage-1 spend.
+    prompt_text = priority_tail
+    for _ in range(2):
+        priority_response = _create_message(dict(
+            model=PRIORITY_MODEL,
+            max_tokens=max(256, min(800, 8 * len(emails))),  # two integer lists
             temperature=0,
-            messages=[{"role": "user", "content": priority_prompt}]
-        )
-        
-        priority_text = "".join(getattr(b, "text", "") for b in priority_response.content)
+            tools=[PRIORITY_TOOL],
+            tool_choice={"type": "tool", "name": PRIORITY_TOOL["name"]},
+            messages=_user_message(priority_prefix, prompt_text)
+        ), use_batch, "priority")
         
-        # Parse priority response
-        import json
         try:
-            start = priority_text.find("{")
-            end = priority_text.rfind("}") + 1
-            priorities = json.loads(priority_text[start:end])
-            high_priority_indexes = priorities.get("high_priority", [])
-            medium_priority_indexes = priorities.get("medium_priority", [])
+            priorities = next(b.input for b in priority_response.content if b.type == "tool_use")
+            # Drop any index that doesn't point at an email
+            high_priority_indexes = [i for i in priorities["high_priority"] if 0 <= i < len(emails)]
+            medium_priority_indexes = [i for i in priorities["medium_priority"] if 0 <= i < len(emails)]
             
             print(f"✅ Identified {len(high_priority_indexes)} high-priority + {len(medium_priority_indexes)} medium-priority emails")
-        except:
-            print("⚠️  Priority parsing failed, using chronological order")
-            high_priority_indexes = list(range(min(15, len(emails))))
-            medium_priority_indexes = list(range(15, min(25, len(emails))))
+            break
+        except (StopIteration, KeyError, TypeError, ValueError) as e:
+            print(f"⚠️  Priority response unusable ({e!r})")
+            prompt_text = priority_tail + PRIORITY_RETRY_NUDGE
+    else:
+        print("⚠️  Priority parsing failed, using chronological order")
+        high_priority_indexes = list(range(min(15, len(emails))))
+        medium_priority_indexes = list(range(15, min(25, len(emails))))
+    
+    return high_priority_indexes, medium_priority_indexes
+
+@functools.cache
+def _embedder():
+    from sentence_transformers import SentenceTransformer  # optional, heavy (pulls in torch)
+    return SentenceTransformer(EMBED_MODEL)
+
+def _prioritize_by_embedding(emails: list[dict], team_context: str,
+                             min_gap: Optional[float] = None) -> Optional[tuple[list[int], list[int]]]:
+    """
+    Stage 1 without an LLM call: rank "source: title" lines by cosine similarity
+    to the team context with a small local embedding model. With min_gap, the
+    ranking is only used for more than 20 emails, when the 20th-best score beats
+    the 26th-best (or the last) by more than min_gap; 20 or fewer are left to
+    Claude, which can still drop the irrelevant ones. None if it isn't decisive
+    or the model can't be loaded or run.
+    """
+    try:
+        model = _embedder()
+        ctx = model.encode(team_context[:2000], normalize_embeddings=True)
+        headers = model.encode([f"{e['source']}: {e['title']}" for e in emails], normalize_embeddings=True)
+    except ImportError:
+        print("⚠️  STAGE1_RANKER=embeddings needs `pip install sentence-transformers`; ranking with Claude")
+        return None
+    except Exception as e:
+        # e.g. the model download failed: losing the local ranking must not lose the brief
+        print(f"⚠️  Embedding ranking failed ({e}); ranking with Claude")
+        return None
+    scores = headers @ ctx
+    order = (-scores).argsort().tolist()
+    if min_gap is not None:
+        if len(order) <= 20:
+            print(f"🤔 Only {len(order)} emails, no top-20 cut to check; ranking with Claude")
+            return None
+        gap = float(scores[order[19]] - scores[order[min(25, len(order) - 1)]])
+        if gap <= min_gap:
+            print(f"🤔 Embedding ranking not decisive (top-20 gap {gap:.2f}), ranking with Claude")
+            return None
+    print(f"✅ Ranked {len(emails)} emails against team context locally")
+    return order[:20], order[20:30]
+
+def _email_detail(email: dict) -> dict:
+    """An email as sent to Stage 2 for deep analysis"""
+    detail = {
+        "title": email["title"],
+        "source": email["source"],
+        "date": email["date"],
+        "text": _truncate_tokens(email["text"], EMAIL_TOKENS),
+        "url": email.get("web_link") or email.get("gmail_link"),
+    }
+    if email.get("also_covered"):
+        detail["also_covered"] = email["also_covered"]
+    return detail
+
+def generate_weekly_brief(use_batch: bool = False, progress_file: Optional[pathlib.Path] = None) -> str:
+    """Generate weekly brief from emails + context"""
+
+    # 1. Calculate Thu→Thu window
+    window = get_thursday_window()
+    print(f"📅 Coverage window: {window['display']}")
+
+    # 2. Load configuration
+    config = load_config()
+
+    # 3-5. Team context, previous briefs and the Gmail fetch are independent — run them concurrently
+    print("📚 Loading team context and previous brief history...")
+    print(f"📧 Fetching emails from {window['display']}...")
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        team_future = ex.submit(load_team_context)
+        briefs_future = ex.submit(load_previous_briefs)
+        # Thu→Thu window, filtered by Gmail itself
+        emails_future = ex.submit(
+            fetch_newsletters,
+            {"mode": "range", "start_ms": window["start_ms"], "end_ms": window["end_ms"]},
+            config["news_query"],
+        )
+
+        team_context = team_future.result()
+        previous_briefs = _render_previous_briefs(briefs_future.result())
+        emails = emails_future.result()
+
+    print(f"📊 Found {len(emails)} emails in {window['display']} window")
+
+    # Drop cross-posts and repeat sends before they cost prompt tokens
+    emails = _collapse_near_duplicates(_dedup_emails(emails))
+
+    # 6. Two-stage processing to handle ALL emails
+    # Decide on estimated prompt size (~4 chars/token), not email count: 21 short
+    # emails fit fine in one pass, 19 long ones may not
+    approx_tokens = sum(len(e["title"]) + len(e["source"]) + len(e["text"]) for e in emails) // 4
+    if approx_tokens > STAGE1_TOKEN_THRESHOLD:
+        print(f"🤖 Using two-stage processing for all {len(emails)} emails (~{approx_tokens} tokens)...")
+        
+        # STAGE 1: Quick prioritization scan of ALL email titles
+        print("Stage 1: Prioritizing emails by relevance...")
+        # Stage-2 payloads (token truncation) don't depend on the ranking: build them
+        # for every email while the Stage-1 request is in flight, then pick by index.
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            details_future = ex.submit(lambda: [_email_detail(e) for e in emails])
+            
+            ranked = None
+            ranker = os.getenv("STAGE1_RANKER", "auto").lower()
+            if ranker == "embeddings":
+                ranked = _prioritize_by_embedding(emails, team_context)
+            elif ranker == "auto" and importlib.util.find_spec("sentence_transformers") is not None:
+                # Only skip the Claude call when the local ranking clearly separates the top 20
+                ranked = _prioritize_by_embedding(emails, team_context, min_gap=STAGE1_SCORE_GAP)
+            high_priority_indexes, medium_priority_indexes = ranked or _prioritize_with_claude(emails, team_context, use_batch)
+            details = details_future.result()
         
         # STAGE 2: Deep analysis of prioritized emails
         print("Stage 2: Deep analysis of prioritized emails...")
-        priority_emails = [emails[i] for i in high_priority_indexes[:20]]  # Top 20 for deep analysis
         summary_emails = [emails[i] for i in medium_priority_indexes[:10]]   # Next 10 for brief summary
         
-        # Prepare detailed data for priority emails
-        email_data = []
-        for email in priority_emails:
-            email_data.append({
-                "title": email["title"],
-                "source": email["source"], 
-                "date": email["date"],
-                "text": email["text"][:3000],
-                "url": email.get("web_link") or email.get("gmail_link")
-            })
+        # Detailed data for the top 20 priority emails, prepared during Stage 1
+        email_data = [details[i] for i in high_priority_indexes[:20]]
         
         # Add brief summaries of medium priority
         summary_data = []
@@ -226,7 +753,7 @@ BIAS TOWARD RECENT CONTENT: Give extra weight to emails from the last 7 days for
                 "title": email["title"],
                 "source": email["source"], 
                 "date": email["date"],
-                "brief_text": email["text"][:500]  # Much shorter for summary
+                "brief_text": _truncate_tokens(email["text"], SUMMARY_TOKENS)  # Much shorter for summary
             })
         
         print(f"🔍 Processing {len(email_data)} emails in detail + {len(summary_data)} email summaries")
@@ -234,176 +761,67 @@ BIAS TOWARD RECENT CONTENT: Give extra weight to emails from the last 7 days for
     else:
         print(f"✅ Processing all {len(emails)} emails found")
         # Simple processing for smaller batches
-        email_data = []
+        email_data = [_email_detail(email) for email in emails]
         summary_data = []
-        for email in emails:
-            email_data.append({
-                "title": email["title"],
-                "source": email["source"], 
-                "date": email["date"],
-                "text": email["text"][:3000],
-                "url": email.get("web_link") or email.get("gmail_link")
-            })
     
     # 7. Generate brief with Claude
-    anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-
-    prompt = f"""You are writing a weekly AI brief in the voice of Jason Fried.
-
-VOICE & STYLE — THIS IS CRITICAL:
-
-Jason Fried writes like he talks. Calm confidence. No hedging. Short sentences that land. He states things as facts, then lets you sit with them.
-
-From his writing:
-> "What was simple is now complicated. What was clear is now cluttered. What just worked now takes work."
-> "Delegating to competency lets you forget about it completely. That's real leverage."
-> "Lag is the giveaway that the system is working too hard for too little."
-
-RULES:
-1. Cut 70% of the words. If it can be shorter, make it shorter.
-2. Specific over abstract. "Claude Code grew up" not "The tools are settling"
-3. Let the reader figure it out. NO "what this means for you" sections. Just state the thing.
-4. End with a punch. Last sentence of each section should land. Period does the work.
-5. Calm, not excited. No exclamation points. No "game-changing" or "revolutionary."
-6. NO bullet points for steps. Collapse to one line.
-7. NO time estimates. NO "Solves:" labels.
-8. NO "Worth watching:" — if it's worth watching, say why in the prose.
-
-WORDS TO NEVER USE:
-- "comprehensive" — cut it
-- "significant" — be specific instead
-- "utilize" — say "use"
-- "leverage" — say "use"
-- "implement" — say "build" or "add"
-- "facilitate" — say "help" or cut
-- "In order to" — just say what happens
-- "It's important to note that" — cut entirely
-- "This is significant because" — just state the significance
-
-TEAM CONTEXT (for relevance filtering, not for explicit mention):
-{team_context[:3000]}
-
-PREVIOUS BRIEFS (avoid repetition):
-{previous_briefs[:2000]}
-
-NEWSLETTERS FROM {window['display'].upper()}:
-{yaml.dump(email_data, default_flow_style=False)[:12000]}
-
----
-
-OUTPUT FORMAT — FOLLOW EXACTLY:
-
-# [Headline grounded in specific content]
-
-The headline must be specific. Not "AI Tools Mature" — instead "Claude Code grew up and now other tools can follow"
-Formula: [Specific thing that happened] + [what it means]
 
-## What Actually Happened
-
-**[Most important thing. Bold, declarative, like a headline].** (Date)
-
-[2-3 short paragraphs. State facts with confidence. No "What it is:" labels. End with insight, not summary. The last sentence should punch.]
-
-**[Second thing].** (Date)
-
-[1-2 paragraphs. Shorter than the first. End with punch.]
-
-**[Third thing].** (Date)
-
-[1-2 paragraphs. Can be very brief. End with punch.]
-
----
-
-## Worth Your Attention
-
-**[Topic as conversational hook, not formal title]** (Date)
-
-[2-3 sentences. The point, not the details. Trust the reader.]
-
-**[Topic]** (Date)
-
-[1-2 sentences. Even shorter.]
-
-**[Topic]**
-
-[One sentence is fine.]
-
----
-
-## Things to Try
-
-**[Action in bold].** [One sentence of context. No bullet points. Simple.]
-
-**[Action].** [Context.]
-
-**[Action].** [Context.]
-
----
-
-## The Pattern
-
-[The meta-insight in 2-3 sentences. What did this week reveal about where things are going? End with punch.]
-
----
-
-*Sources: [comma-separated list]*
-
----
-
-EXAMPLE OF CORRECT VOICE:
-
-BAD (verbose, labeled):
-**Claude Code Updates** (Jan 22-29)
-**What it is:** Anthropic released several updates to Claude Code this week including VS Code extension GA, a new desktop app called Cowork, and a diff viewer on web.
-**What it means for you:** This represents a significant maturation of the tooling. Teams should consider...
-
-GOOD (Jason Fried voice):
-**Claude Code grew up.** (Jan 22-29)
-Anthropic shipped a lot this month. The VS Code extension hit general availability. A desktop app called Cowork launched for non-coding tasks. A diff viewer showed up on web.
-But here's what matters: these aren't features for early adopters anymore. They're features for everyone else. Less configuration, more just working.
-
-BAD (bullet list):
-**Set up Claude Code in VS Code** → Solves: Development workflow → Time: 30 min
-• Download the extension
-• Configure your API key
-• Start with @-mentioning files
-
-GOOD (collapsed, punchy):
-**Set up Claude Code in VS Code.** Now GA. Start with @-mentioning files for context. Use slash commands. Simple.
-
----
-
-FINAL CHECK — Before outputting, ask:
-1. Would Jason Fried write this? If it sounds corporate, rewrite.
-2. Can I cut more? If yes, cut.
-3. Does each section end with a punch?
-4. Did I explain too much? Trust the reader."""
-
-    response = anthropic_client.messages.create(
-        model="claude-3-7-sonnet-20250219",
+    prompt_prefix = "".join([
+        PROMPT_HEAD,
+        _truncate_tokens(team_context, BUDGET["team"]),
+        PROMPT_MID,
+        _truncate_tokens(previous_briefs, BUDGET["prev"]),
+        PROMPT_FORMAT,
+    ])
+    prompt_tail = "".join([
+        PROMPT_EMAILS_HDR.format(window=window['display'].upper()),
+        # Per-email trimming keeps every record whole; the fit is only a backstop
+        _to_json(_fit_to_budget(_share_budget(email_data, BUDGET["emails"]), BUDGET["emails"])),
+    ])
+
+    brief_params = dict(
+        model=BRIEF_MODEL,
         max_tokens=8000,  # Increased for more thorough analysis
         temperature=0.3,  # Slight creativity for better connections
-        messages=[{"role": "user", "content": prompt}]
+        messages=_user_message(prompt_prefix, prompt_tail)
     )
-    
-    brief_text = "".join(getattr(b, "text", "") for b in response.content)
+    if use_batch:
+        response = _create_message(brief_params, use_batch, "brief")
+        brief_text = "".join(getattr(b, "text", "") for b in response.content)
+    else:
+        # Stream so API errors surface on the first event instead of after the full
+        # 8000-token generation. Chunks are mirrored to progress_file as they arrive
+        # (tail -f to watch); main() still writes the finished brief in one go.
+        chunks = []
+        with _client().messages.stream(**brief_params) as stream, \
+                (progress_file.open("w", encoding="utf-8") if progress_file else contextlib.nullcontext()) as progress:
+            for text in stream.text_stream:
+                chunks.append(text)
+                if progress:
+                    progress.write(text)
+                    progress.flush()
+        brief_text = "".join(chunks)
     return brief_text, window
 
-def main():
+def main(use_batch: bool = False):
     """Generate and post weekly brief"""
     try:
         print("🤖 Generating weekly AI brief...")
 
-        # Generate brief
-        brief, window = generate_weekly_brief()
-
-        # Save to file (original location)
         weekly_dir = ROOT / "summaries" / "weekly"
         weekly_dir.mkdir(parents=True, exist_ok=True)
-
-        filename = f"{datetime.now().strftime('%Y-%m-%d')}-weekly.md"
+        filename = _brief_filename()
         output_file = weekly_dir / filename
-        output_file.write_text(brief, encoding="utf-8")
+        # Brief text as it streams in; replaced by output_file once complete
+        progress_file = output_file.with_name(filename + ".partial")
+
+        # Generate brief
+        brief, window = generate_weekly_brief(use_batch, progress_file)
+
+        # Save to file (original location)
+        data = _with_frontmatter(brief, window).encode("utf-8")
+        output_file.write_bytes(data)
+        progress_file.unlink(missing_ok=True)
 
         print(f"✅ Brief saved: {output_file}")
 
@@ -411,7 +829,12 @@ def main():
         pulse_newsletter_dir = PULSE_DIR / "context" / "newsletter"
         pulse_newsletter_dir.mkdir(parents=True, exist_ok=True)
         pulse_output_file = pulse_newsletter_dir / filename
-        pulse_output_file.write_text(brief, encoding="utf-8")
+        # Hardlink when both dirs share a filesystem; kernel-side copy across devices
+        try:
+            pulse_output_file.unlink(missing_ok=True)  # re-runs on the same day
+            os.link(output_file, pulse_output_file)
+        except OSError:
+            shutil.copyfile(output_file, pulse_output_file)
 
         print(f"📝 Brief also saved to Pulse: {pulse_output_file}")
 
@@ -424,9 +847,11 @@ def main():
 
     except Exception as e:
         print(f"❌ Error: {e}")
-        import traceback
         traceback.print_exc()
         return None
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate and post the weekly AI brief")
+    parser.add_argument("--batch", action="store_true",
+                        help="send Claude calls through the Message Batches API (half price, slower; for scheduled runs)")
+    main(use_batch=parser.parse_args().batch)